@@ -2,6 +2,7 @@ import clang
 import clang.cindex
 
 import logging
+from CTutorUtils import BLOCK_FUNC_LST
 LOGGING_FORMAT= "%(name)s:%(levelname)s %(module)s:%(lineno)d:  %(message)s"
 logging.basicConfig(filename="CTutor.log", level=logging.DEBUG, format= LOGGING_FORMAT)
 
@@ -10,23 +11,7 @@ logging.basicConfig(filename="CTutor.log", level=logging.DEBUG, format= LOGGING_
 #  - Findout whether the file has dangerous file operation function calls
 #  - TODO: get the live range of each variable
 class CParser(object):
-  BLOCK_FUNC_LST = [
-    "fopen",
-    "fprintf",
-    "fwrite",
-    "fputs",
-    "scanf",
-    "fork",
-    "exec",
-    "pthread_create",
-    "execvp",
-    "getpid",
-    "execl",
-    "execlp",
-    "execle",
-    "execv",
-    "execve"
-  ]
+  BLOCK_FUNC_LST = BLOCK_FUNC_LST
 
   def __init__(self, fn):
     index = clang.cindex.Index.create()
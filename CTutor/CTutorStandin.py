@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import os
+import re
+import sys
+import time
+import codecs
+import logging
+from CTutorUtils import BLOCK_FUNC_LST, CTutorBudget, encode_trace_json
+
+# Stand-ins for clang and LLDB, selected by CTUTOR_BACKEND=standin.
+# They let c_tutor.py and load_test.py run on a plain Linux box without
+# llvm installed. Each stand-in keeps the interface of the class it replaces
+# and sleeps a configurable time, so that the rest of the pipeline (portal,
+# process spawn, file IO, budgets) is exercised as in production:
+#
+#   CTUTOR_STANDIN_COMPILE_MS: time taken by the stand-in compiler, default 50
+#   CTUTOR_STANDIN_STEP_MS: time taken by each trace step, default 5
+#
+# The stand-in trace has one step per non-empty source line, it does not run
+# the program. It honours the same CTutorBudget as Trace, and encodes the trace
+# the same way, but a program only runs into them if it has enough lines, e.g. an
+# infinite loop is only cut off with the lldb backend. There is no target heap,
+# so the target memory budget never applies.
+
+def env_ms(name, default):
+  return float(os.getenv(name, default)) / 1000.0
+
+def standin_compiler():
+  # Command line used in place of CTutorSingle.COMPILER
+  return " ".join([sys.executable, os.path.abspath(__file__), "cc"])
+
+def compile_main(argv):
+  # Called as: CTutorStandin.py cc [clang options] src.c [libs] -o bin
+  # c_tutor.py passes "-o bin" joined, the shell splits it again.
+  time.sleep(env_ms("CTUTOR_STANDIN_COMPILE_MS", 50))
+  src_fns = [arg for arg in argv if arg.endswith(".c")]
+  if not "-o" in argv or len(src_fns) != 1 or not os.path.exists(src_fns[0]):
+    print("CTutorStandin: usage: cc [options] src.c -o bin", file=sys.stderr)
+    return 1
+  bin_f = open(argv[argv.index("-o") + 1], "w")
+  bin_f.write("CTutor stand-in binary for %s\n"%src_fns[0])
+  bin_f.close()
+  return 0
+
+
+class StandinParser(object):
+  # Stand-in for CTutorParser.CParser, matches calls with a regex instead of
+  # walking the clang AST
+  CALL_RE = re.compile(r"\b(%s)\s*\("%"|".join(BLOCK_FUNC_LST))
+
+  def __init__(self, fn):
+    self._src = open(fn).read()
+
+  def check_all_func_call(self):
+    found = self.CALL_RE.search(self._src)
+    if found:
+      logging.debug("StandinParser found %s"%found.group(1))
+    return found != None
+
+
+class StandinTrace(object):
+  # Stand-in for Trace.Trace, writes a well-formed trace in the same format
+  def __init__(self, src, binary, trace, max_num_step=None, max_wall_time=None,
+               max_trace_bytes=None, max_target_memory=None, start_time=None):
+    self.src_fn = src
+    self.bin_fn = binary
+    self.trace_fn = trace
+    self.budget = CTutorBudget(max_num_step, max_wall_time, max_trace_bytes,
+                               max_target_memory, start_time)
+    self.trace = [] # trace entries, each already encoded as json
+    self._trace_bytes = 0
+
+  def append_trace(self, entry):
+    entry_str = encode_trace_json(entry)
+    self._trace_bytes += len(entry_str)
+    self.trace.append(entry_str)
+
+  def run(self):
+    code = open(self.src_fn).read()
+    step_time = env_ms("CTUTOR_STANDIN_STEP_MS", 5)
+    lines = code.split("\n")
+    for (line_num, line) in enumerate(lines):
+      if not line.strip():
+        continue
+      exceeded = self.budget.exceeded(len(self.trace), self._trace_bytes)
+      if exceeded != None:
+        self.append_trace(self.budget.truncation_event(len(self.trace), exceeded))
+        break
+      time.sleep(step_time)
+      self.append_trace({
+        'ordered_globals' : [],
+        'stdout' : '',
+        'func_name' : 'main',
+        'stack_to_render' : [{
+          'frame_id' : 1,
+          'encoded_locals' : {},
+          'func_name' : 'main',
+          'unique_hash' : 'main0',
+          'ordered_varnames' : [],
+          'parent_frame_id_list' : [],
+          'is_zombie' : False,
+          'is_parent' : False,
+          'is_highlighted' : True,
+        }],
+        'globals' : {},
+        'heap' : {},
+        'line' : line_num + 1,
+        'event' : 'step_line',
+      })
+    pytutor_trace_str = '{"code":%s,"trace":[%s]}'%(encode_trace_json(code), ",".join(self.trace))
+    codecs.open(self.trace_fn,'w','utf-8').write(" var demoTrace = " + pytutor_trace_str + ";")
+
+
+if __name__ == "__main__":
+  if len(sys.argv) > 1 and sys.argv[1] == "cc":
+    sys.exit(compile_main(sys.argv[2:]))
+  print("Usage: CTutorStandin.py cc [options] src.c -o bin", file=sys.stderr)
+  sys.exit(1)
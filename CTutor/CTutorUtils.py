@@ -1,12 +1,33 @@
 from __future__ import print_function
 import logging
 import json
+import os
 import threading
 import subprocess
+import time
+from contextlib import contextmanager
 
 LOGGING_FORMAT= "%(asctime)-15s %(name)s:%(levelname)s %(module)s:%(lineno)d:  %(message)s"
 logging.basicConfig(filename="CTutor.log", level=logging.DEBUG, format= LOGGING_FORMAT)
 
+# Function calls which are not allowed in the submitted C code
+BLOCK_FUNC_LST = [
+  "fopen",
+  "fprintf",
+  "fwrite",
+  "fputs",
+  "scanf",
+  "fork",
+  "exec",
+  "pthread_create",
+  "execvp",
+  "getpid",
+  "execl",
+  "execlp",
+  "execle",
+  "execv",
+  "execve"
+]
 
 
 class CTutorFP(object):
@@ -30,6 +51,62 @@ class CTutorFPEncoder(json.JSONEncoder):
       return str(obj)
     return json.JSONEncoder.default(self, obj)
 
+def encode_trace_json(obj, compact=False):
+  # Encoding of the trace and its entries, shared by Trace and StandinTrace so
+  # that the trace size budget measures the same output
+  if compact:
+    return json.dumps(obj, cls = CTutorFPEncoder)
+  else:
+    return json.dumps(obj, sort_keys=True, indent=2, separators=(',',':'), cls = CTutorFPEncoder)
+
+class CTutorBudget(object):
+  # Per-run budgets of a trace. When any of them is exceeded, the trace is cut
+  # off with an "instruction_limit_reached" event, so a partial trace is still
+  # well-formed.
+  MAX_NUM_STEP = 100
+
+  # seconds of wall time, counted from start_time (the start of c_tutor.py), so
+  # that compile and safety check use up the same budget. portal_ctutor.js
+  # passes its own via CTUTOR_MAX_WALL_TIME, below its worker kill timeout.
+  MAX_WALL_TIME = 4
+
+  # bytes of encoded trace entries
+  MAX_TRACE_BYTES = 1024 * 1024
+
+  # bytes allocated on the target heap through libsample
+  MAX_TARGET_MEMORY = 1024 * 1024
+
+  def __init__(self, max_num_step=None, max_wall_time=None, max_trace_bytes=None,
+               max_target_memory=None, start_time=None):
+    self.max_num_step = max_num_step or CTutorBudget.MAX_NUM_STEP
+    self.max_wall_time = max_wall_time or CTutorBudget.MAX_WALL_TIME
+    self.max_trace_bytes = max_trace_bytes or CTutorBudget.MAX_TRACE_BYTES
+    self.max_target_memory = max_target_memory or CTutorBudget.MAX_TARGET_MEMORY
+    self.start_time = start_time or time.time()
+
+  def remaining_time(self):
+    return max(0, self.start_time + self.max_wall_time - time.time())
+
+  def wall_time_exceeded(self):
+    return "run time exceeds %s seconds"%str(self.max_wall_time)
+
+  def exceeded(self, num_step, trace_bytes, target_memory=0, deadline_hit=False):
+    # Return why the trace is over budget, or None. Called once per step, so
+    # every check here only looks at counters kept up to date by the caller.
+    if num_step >= self.max_num_step:
+      return "step count exceeds %d"%self.max_num_step
+    if deadline_hit or time.time() - self.start_time >= self.max_wall_time:
+      return self.wall_time_exceeded()
+    if trace_bytes >= self.max_trace_bytes:
+      return "trace size exceeds %d bytes"%self.max_trace_bytes
+    if target_memory >= self.max_target_memory:
+      return "heap memory exceeds %d bytes"%self.max_target_memory
+    return None
+
+  def truncation_event(self, num_step, reason):
+    return {'event' : 'instruction_limit_reached',
+            'exception_msg' : 'Stopped tracing after %d steps, %s'%(num_step, reason)}
+
 class CTutorCommand(object):
   def __init__(self, cmd):
     self.cmd = cmd
@@ -54,3 +131,38 @@ class CTutorCommand(object):
     process_ret_code = self.process.returncode
     logging.debug("Thread %s exit with code:%s"%(" ".join(self.cmd), str(process_ret_code)))
     return process_ret_code
+
+class CTutorStageTimer(object):
+  # Record the wall time of each stage of a c_tutor.py run, so that the load
+  # test can break the end-to-end latency down by stage.
+  def __init__(self):
+    self.stages = []
+    self.failed_stage = None
+
+  @contextmanager
+  def stage(self, name):
+    start = time.time()
+    try:
+      yield
+    except BaseException:
+      # sys.exit() in a stage also lands here
+      self.failed_stage = name
+      raise
+    finally:
+      self.stages.append([name, time.time() - start])
+      logging.debug("Stage %s took %.4f seconds"%(name, self.stages[-1][1]))
+
+  def dump(self, fn, src):
+    # Append one JSON line per run, small enough for O_APPEND to keep
+    # concurrent runs from interleaving
+    if not fn:
+      return
+    record = {
+      'src' : src,
+      'pid' : os.getpid(),
+      'stages' : self.stages,
+      'failed_stage' : self.failed_stage,
+    }
+    stage_f = open(fn, "a")
+    stage_f.write(json.dumps(record) + "\n")
+    stage_f.close()
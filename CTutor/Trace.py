@@ -1,10 +1,11 @@
 from __future__ import print_function
 
-import json
 import lldb, sys
 import logging
 import codecs
-from CTutorUtils import CTutorFP, CTutorFPEncoder
+import threading
+import zlib
+from CTutorUtils import CTutorFP, CTutorBudget, encode_trace_json
 
 # "int"/"long"/"long long" are treated the same way
 # "float"/"double" are treated the same way
@@ -17,6 +18,12 @@ from CTutorUtils import CTutorFP, CTutorFPEncoder
 #
 # Value at an address are fetched by letting LLDB read memory. We query LLDB for field types.
 #
+# Heap snapshots are incremental. Each allocation is read with one bulk read per step,
+#   and each chunk keeps its encoded value with a crc32 of its raw bytes. A chunk is
+#   only re-decoded when its bytes changed, or when an alloc/free touches it or a
+#   pointer it holds. Pointers are followed with a visited set, so linked structures
+#   are walked once per step, even if they have cycles.
+#
 # array are treated as LIST.
 #
 # "malloc/realloc/calloc" allocates multiple data chunks in heap.
@@ -39,13 +46,12 @@ from CTutorUtils import CTutorFP, CTutorFPEncoder
 # TODO handle on stack struct variable
 # this is difficult as need to track lifetime of the variable
 
-# TODO support multiple level pointer
-
 class Trace(object) :
 
   MAX_STDOUT = 100
 
-  MAX_NUM_STEP = 100
+  # seconds between two interrupts sent by the watchdog after the deadline
+  INTERRUPT_INTERVAL = 0.1
 
   kUnknownType = None
   IGNORE_SBVALUE_NAME_LST = [
@@ -59,20 +65,33 @@ class Trace(object) :
   POINTTO_STACK=3
   
 
-  def __init__(self, src, binary, trace):
+  def __init__(self, src, binary, trace, max_num_step=None, max_wall_time=None,
+               max_trace_bytes=None, max_target_memory=None, start_time=None):
     self.dbg = lldb.SBDebugger.Create()
     self.dbg.SetAsync(False)
     lldb.debugger = self.dbg
 
     self.ci = self.dbg.GetCommandInterpreter()
     self.pytutor_trace = {}
-    self.trace = []
+    self.trace = [] # trace entries, each already encoded as json
     self.heap = {}
     self.heap_allocations = {} # dict of address -> (type, #byte)
+    self._heap_cache = {} # dict of address -> (type name, crc32, value, refs)
+    self._heap_snapshot = {} # dict of allocation address -> raw bytes, per step
+    self._heap_visited = set()
+    self._heap_decoding = [] # stack of chunks being decoded, collects refs
     self.stdout = ''
     self.src_fn = src
     self.bin_fn = binary
     self.trace_fn = trace
+
+    self.budget = CTutorBudget(max_num_step, max_wall_time, max_trace_bytes,
+                               max_target_memory, start_time)
+    self._deadline_hit = False
+    self._tracing_done = threading.Event()
+    self._target_memory = 0 # bytes in heap_allocations
+    self._trace_bytes = 0
+    self.process = None
   
     self.error = lldb.SBError()
     self._NDEBUG=False
@@ -87,7 +106,35 @@ class Trace(object) :
   def run(self):
 
     self.pytutor_trace['code'] = open(self.src_fn).read()
+    # A step which never returns, e.g. "while(1);" or a blocking library call,
+    # never gets back to exceeded_budget, so the deadline is also enforced
+    # from a watchdog thread which interrupts the target.
+    watchdog = threading.Thread(target=self.watchdog)
+    watchdog.daemon = True
+    watchdog.start()
+    try:
+      self.trace_steps()
+    except Exception as e:
+      # Keep the steps traced so far, and tell the user why the trace stops here
+      logging.exception("Trace stopped by an unexpected error")
+      self.append_trace({'event' : 'uncaught_exception',
+                         'exception_msg' : 'CTutor stopped tracing here: %s'%str(e)})
+    self._tracing_done.set()
+    watchdog.join()
+
+    if self.process != None:
+      self.process.Destroy()
+    logging.debug('before exit')
+    self.exec_command('exit')
 
+    # The trace entries are encoded once in append_trace, so only join them here
+    pytutor_trace_str = '{"code":%s,"trace":[%s]}'%(encode_trace_json(self.pytutor_trace['code'], self._NDEBUG),
+                                                     ",".join(self.trace))
+
+    logging.debug(pytutor_trace_str)
+    codecs.open(self.trace_fn,'w','utf-8').write(" var demoTrace = " + pytutor_trace_str + ";")
+
+  def trace_steps(self):
     self.exec_command('file ' + self.bin_fn)
     self.exec_command('b _start')
     self.exec_command('b main')
@@ -114,33 +161,57 @@ class Trace(object) :
       logging.debug("#####Dump trace at %s Line %d "%(self.get_file_path(), cur_line_num))
       self.dump_status(self.target)
       logging.debug("#####Dump trace at %s Line %d Done. Current Step %d "%(self.get_file_path(), cur_line_num, num_step))
-      succeeded = self.exec_command('s').Succeeded()
       num_step += 1
-      if num_step >= Trace.MAX_NUM_STEP:
-        logging.debug("Break the trace record, step exceeds the MAX_NUM_STEP %d"%(Trace.MAX_NUM_STEP))
+      exceeded = self.exceeded_budget(num_step)
+      if exceeded != None:
+        self.truncate_trace(num_step, exceeded)
+        break
+      succeeded = self.exec_command('s').Succeeded()
+      if self._deadline_hit:
+        self.truncate_trace(num_step, self.budget.wall_time_exceeded())
         break
       if self.get_file_path() != self.src_fn:
+        if self._deadline_hit:
+          self.truncate_trace(num_step, self.budget.wall_time_exceeded())
+          break
         succeeded = self.exec_command('finish').Succeeded()
         logging.debug("Not in the source code file anymore, might be a printf function call"
                       ", finish current frame, so that the control could return back to the"
                       " original source code file")
+        if self._deadline_hit:
+          self.truncate_trace(num_step, self.budget.wall_time_exceeded())
+          break
       line_number = self.get_line_number()
       if line_number == 0:
         logging.debug("Current Line number:%d, break"%line_number)
         break
-    self.process.Destroy()
-    logging.debug('before exit')
-    self.exec_command('exit')
-    self.pytutor_trace['trace'] = self.trace
-    
-    if self._NDEBUG:
-      pytutor_trace_str = json.dumps(self.pytutor_trace)
-    else:
-      pytutor_trace_str = json.dumps(self.pytutor_trace, sort_keys=True, indent=2, separators=(',',':'), 
-                                     cls = CTutorFPEncoder)
 
-    logging.debug(pytutor_trace_str)
-    codecs.open(self.trace_fn,'w','utf-8').write(" var demoTrace = " + pytutor_trace_str + ";")
+  def watchdog(self):
+    # Wait for the deadline, then interrupt the target until trace_steps
+    # returns. An interrupt sent while the target is stopped, just before
+    # trace_steps resumes it, is ignored by LLDB, so it is sent again.
+    if self._tracing_done.wait(self.budget.remaining_time()):
+      return
+    logging.debug("Wall time budget runs out, interrupt the target")
+    self._deadline_hit = True
+    while not self._tracing_done.is_set():
+      if self.process != None:
+        self.process.SendAsyncInterrupt()
+      self._tracing_done.wait(Trace.INTERRUPT_INTERVAL)
+
+  def truncate_trace(self, num_step, reason):
+    logging.debug("Break the trace record, %s"%reason)
+    self.append_trace(self.budget.truncation_event(num_step, reason))
+
+  def append_trace(self, entry):
+    # Encode the entry as it is written out, so _trace_bytes is the real
+    # trace size without encoding any step twice
+    entry_str = encode_trace_json(entry, self._NDEBUG)
+    self._trace_bytes += len(entry_str)
+    self.trace.append(entry_str)
+
+  def exceeded_budget(self, num_step):
+    return self.budget.exceeded(num_step, self._trace_bytes, self._target_memory, self._deadline_hit)
 
   def is_string_type(self, type_):
     assert False
@@ -275,13 +346,7 @@ class Trace(object) :
     logging.debug("check pointer_val %d"%pointer_val)
 
     # Check Heap
-    for addr in self.heap_allocations:
-      #import pdb
-      #pdb.set_trace()
-      (typ, num_bytes) = self.heap_allocations[addr]
-      if addr <= pointer_val <= addr + num_bytes:
-        found = True
-        break
+    found = self.find_heap_allocation(pointer_val) != None
 
     logging.debug("is_valid_pointer: check whether it is a valid point to heap: %s"%(str(found)))
     if found:
@@ -310,6 +375,14 @@ class Trace(object) :
     logging.debug("is_valid_pointer: check whether it is a valid point to stack vars: %s"%(str(found)))
     return self.POINTTO_UNKNOWN
 
+  def find_heap_allocation(self, pointer_val):
+    # Return the start address of the allocation containing pointer_val, or None
+    for addr in self.heap_allocations:
+      (typ, num_bytes) = self.heap_allocations[addr]
+      if addr <= pointer_val <= addr + num_bytes:
+        return addr
+    return None
+
   def process_stdout(self, stdout):
     ALLOC_TAG = 'Alloc = '
     FREE_TAG = 'free' 
@@ -317,13 +390,17 @@ class Trace(object) :
     if stdout.startswith(ALLOC_TAG):
       fields = stdout.split()
       self.heap_allocations[int(self.to_heap_key(fields[2]))] = (self.kUnknownType, int(fields[4]))
+      self._target_memory += int(fields[4])
+      self.invalidate_heap_cache(int(self.to_heap_key(fields[2])), int(fields[4]))
       logging.debug("heap_allocations alloc: %s -> %s"%(self.to_heap_key(fields[2]), str((self.kUnknownType, int(fields[4])))))
       new_stdout = "\r\n".join(stdout.split('\r\n')[1:])
       return new_stdout
     elif stdout.startswith(FREE_TAG):
       fields = stdout.split()
       logging.debug("Heap_allocations free: %s "% self.to_heap_key(fields[1]))
-      del self.heap_allocations[int(self.to_heap_key(fields[1]))]
+      (typ, num_bytes) = self.heap_allocations.pop(int(self.to_heap_key(fields[1])))
+      self._target_memory -= num_bytes
+      self.invalidate_heap_cache(int(self.to_heap_key(fields[1])), num_bytes)
       new_stdout = "\r\n".join(stdout.split('\r\n')[1:])
       return new_stdout
     else:
@@ -336,7 +413,32 @@ class Trace(object) :
       #      print('size_of_type', typ)
       return typ.size
 
-  def put_in_heap(self, sb_value):
+  def invalidate_heap_cache(self, addr, num_bytes):
+    # Drop cached chunks inside [addr, addr + num_bytes], and chunks holding a
+    # pointer into it, as whether such a pointer is valid has just changed.
+    for key in list(self._heap_cache):
+      (type_name, digest, value, refs) = self._heap_cache[key]
+      if addr <= key <= addr + num_bytes or \
+         any(addr <= ref_addr <= addr + num_bytes for (ref_addr, ref_type) in refs):
+        del self._heap_cache[key]
+        logging.debug("Invalidate heap cache for key: %s"%key)
+
+  def chunk_digest(self, key, type_):
+    # crc32 of the raw bytes of the chunk at key, sliced from one bulk read
+    # of its allocation. None if the chunk cannot be read.
+    alloc_addr = self.find_heap_allocation(key)
+    if alloc_addr == None:
+      return None
+    if not alloc_addr in self._heap_snapshot:
+      (typ, num_bytes) = self.heap_allocations[alloc_addr]
+      self._heap_snapshot[alloc_addr] = self.read_memory(alloc_addr, num_bytes)
+    raw = self._heap_snapshot[alloc_addr]
+    if raw == None:
+      return None
+    offset = key - alloc_addr
+    return zlib.crc32(raw[offset:offset + type_.GetByteSize()])
+
+  def propagate_heap_type(self, pointer_val, type_):
     # Propogate type information to heap_allocations
     heap_allocations = dict(self.heap_allocations)
     for addr in self.heap_allocations:
@@ -347,19 +449,47 @@ class Trace(object) :
       num_chunks = num_bytes / chunk_size
       for i in xrange(num_chunks):
         chunk_addr = addr + i * chunk_size
-        if chunk_addr == sb_value.GetValueAsUnsigned(self.error):
+        if chunk_addr == pointer_val:
           # Update type
-          heap_allocations[self.to_heap_key(addr)] = (sb_value.GetType().GetPointeeType(), heap_allocations[self.to_heap_key(addr)][1])
+          heap_allocations[self.to_heap_key(addr)] = (type_, heap_allocations[self.to_heap_key(addr)][1])
           break
     self.heap_allocations = heap_allocations
-    
-    key = self.to_heap_key(sb_value.GetValueAsUnsigned(self.error))
-    if not key in self.heap:
-      value = self.object_view(sb_value)
+
+  def put_in_heap(self, sb_value):
+    self.put_chunk_in_heap(sb_value.GetValueAsUnsigned(self.error), sb_value.GetType().GetPointeeType(), sb_value)
+
+  def put_chunk_in_heap(self, pointer_val, type_, sb_value=None):
+    key = self.to_heap_key(pointer_val)
+    if key in self._heap_visited:
+      logging.debug("Do not put in heap for key: %s, since it is already visited"%key)
+      return
+    self._heap_visited.add(key)
+    self.propagate_heap_type(pointer_val, type_)
+
+    digest = self.chunk_digest(key, type_)
+    cached = self._heap_cache.get(key)
+    if digest != None and cached != None and cached[0] == type_.GetName() and cached[1] == digest:
+      (type_name, digest, value, refs) = cached
       self.heap[key] = value
-      logging.debug("Put in heap: %s -> %s"%(key, value))
-    else:
-      logging.debug("Do not put in heap for key: %s, since it is not in self.heap"%key)
+      logging.debug("Put in heap from cache: %s -> %s"%(key, value))
+      # The chunk is unchanged, but the chunks it points to may not be
+      for (ref_addr, ref_type) in refs:
+        if self.find_heap_allocation(ref_addr) != None:
+          self.put_chunk_in_heap(ref_addr, ref_type)
+      return
+
+    if sb_value == None:
+      sb_value = self.target.CreateValueFromAddress("heap_%x"%key, lldb.SBAddress(key, self.target), type_).AddressOf()
+    self._heap_decoding.append({'refs' : [], 'volatile' : False})
+    value = self.object_view(sb_value)
+    chunk = self._heap_decoding.pop()
+    self.heap[key] = value
+    # Strings are read outside of the chunk bytes, so such chunks are never cached
+    if digest != None and not chunk['volatile']:
+      self._heap_cache[key] = (type_.GetName(), digest, value, chunk['refs'])
+    elif key in self._heap_cache:
+      del self._heap_cache[key]
+    logging.debug("Put in heap: %s -> %s"%(key, value))
 
   def variable_view(self, sb_value, get_pointer_addr=False):
     value = None
@@ -368,6 +498,8 @@ class Trace(object) :
     if type_.IsPointerType() and type_.GetPointeeType() == type_.GetBasicType(lldb.eBasicTypeChar):
       # handle string
       value = self.read_string(sb_value.GetValueAsUnsigned(self.error))
+      if self._heap_decoding:
+        self._heap_decoding[-1]['volatile'] = True
       logging.debug("variable_view for string %s : %s"%(sb_value.GetName(), value))
     elif type_.IsPointerType() and get_pointer_addr:
       value = sb_value.GetValueAsUnsigned(self.error)
@@ -376,6 +508,8 @@ class Trace(object) :
       # handle Pointer type
       value = sb_value.GetValueAsUnsigned(self.error)
       logging.debug("variable_view for pointer %s, the unsigned value is %d "%(sb_value.GetName(), value))
+      if self._heap_decoding:
+        self._heap_decoding[-1]['refs'].append((value, type_.GetPointeeType()))
       pointto = self.point_to(sb_value, value)
       if pointto == self.POINTTO_HEAP:
         value = ["REF", self.to_heap_key(value), "REF_HEAP"]
@@ -427,8 +561,14 @@ class Trace(object) :
     logging.debug("Object_view for %s:%s"%(sb_value.GetName(), value))
     return value
 
-  def dump_status(self, target):
+  def reset_heap_snapshot(self):
+    # Start the heap of a new step, _heap_cache is kept across steps
     self.heap = {}
+    self._heap_visited = set()
+    self._heap_snapshot = {}
+
+  def dump_status(self, target):
+    self.reset_heap_snapshot()
     self._global_addr_name_dmap={}
     self._stack_addr={}
 
@@ -449,7 +589,7 @@ class Trace(object) :
       'line' : line,
       'event' : event, 
     };
-    self.trace = self.trace + [trace]
+    self.append_trace(trace)
 
   def exec_command(self, cmd):
     res = lldb.SBCommandReturnObject()
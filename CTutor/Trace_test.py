@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+
+import struct
+import sys
+import threading
+import time
+import types
+import unittest
+
+# Trace.py needs lldb, which is replaced by a stub here. Only the parts of the
+# SB API used by the heap snapshot code are faked, on top of a flat memory.
+
+lldb = types.ModuleType("lldb")
+lldb.eBasicTypeInt = "int"
+lldb.eBasicTypeChar = "char"
+lldb.eBasicTypeFloat = "float"
+lldb.eBasicTypeDouble = "double"
+
+class FakeDebugger(object):
+  @staticmethod
+  def Create():
+    return FakeDebugger()
+
+  def SetAsync(self, async_):
+    pass
+
+  def GetCommandInterpreter(self):
+    return None
+
+class FakeError(object):
+  pass
+
+class FakeAddress(object):
+  def __init__(self, addr, target):
+    self.addr = addr
+
+lldb.SBDebugger = FakeDebugger
+lldb.SBError = FakeError
+lldb.SBAddress = FakeAddress
+sys.modules["lldb"] = lldb
+
+from Trace import Trace
+
+
+class FakeType(object):
+  def __init__(self, name, size, pointee=None, fields=None):
+    self.name = name
+    self.size = size
+    self.pointee = pointee
+    self.fields = fields or [] # list of (name, type, offset)
+
+  def GetName(self):
+    return self.name
+
+  def GetByteSize(self):
+    return self.size
+
+  def IsPointerType(self):
+    return self.pointee != None
+
+  def GetPointeeType(self):
+    return self.pointee
+
+  def GetBasicType(self, basic_type):
+    return BASIC_TYPES[basic_type]
+
+  def GetTypeClass(self):
+    return 0
+
+  def GetNumberOfFields(self):
+    return len(self.fields)
+
+  def GetFieldAtIndex(self, i):
+    return FakeField(self.fields[i][0])
+
+class FakeField(object):
+  def __init__(self, name):
+    self.name = name
+
+  def GetName(self):
+    return self.name
+
+INT = FakeType("int", 4)
+CHAR = FakeType("char", 1)
+BASIC_TYPES = {
+  "int" : INT,
+  "char" : CHAR,
+  "float" : FakeType("float", 4),
+  "double" : FakeType("double", 8),
+}
+CHAR_PTR = FakeType("char *", 8, pointee=CHAR)
+# struct node { int field; struct node* next; };
+NODE = FakeType("struct node", 16)
+NODE_PTR = FakeType("struct node *", 8, pointee=NODE)
+NODE.fields = [("field", INT, 0), ("next", NODE_PTR, 8)]
+# struct name { char* str; };
+NAME = FakeType("struct name", 8)
+NAME_PTR = FakeType("struct name *", 8, pointee=NAME)
+NAME.fields = [("str", CHAR_PTR, 0)]
+
+
+class FakeMemory(object):
+  BASE = 0x1000
+
+  def __init__(self):
+    self.data = bytearray(0x1000)
+
+  def read(self, addr, size):
+    return bytes(self.data[addr - self.BASE:addr - self.BASE + size])
+
+  def write(self, addr, raw):
+    self.data[addr - self.BASE:addr - self.BASE + len(raw)] = raw
+
+  def write_int(self, addr, value):
+    self.write(addr, struct.pack("<i", value))
+
+  def write_pointer(self, addr, value):
+    self.write(addr, struct.pack("<Q", value))
+
+class FakeValue(object):
+  # A value of type_ in memory at addr, or a pointer value not in memory
+  def __init__(self, memory, addr, type_, name, pointer_val=None):
+    self.memory = memory
+    self.addr = addr
+    self.type_ = type_
+    self.name = name
+    self.pointer_val = pointer_val
+
+  def GetName(self):
+    return self.name
+
+  def GetType(self):
+    return self.type_
+
+  def GetValueAsUnsigned(self, error=None):
+    if self.pointer_val != None:
+      return self.pointer_val
+    return struct.unpack("<Q", self.memory.read(self.addr, 8))[0]
+
+  def GetValueAsSigned(self, error=None):
+    return struct.unpack("<i", self.memory.read(self.addr, 4))[0]
+
+  def GetValue(self):
+    return str(self.GetValueAsSigned())
+
+  def AddressOf(self):
+    return FakeValue(self.memory, None, FakeType(self.type_.name + " *", 8, pointee=self.type_),
+                     "&" + self.name, self.addr)
+
+  def Dereference(self):
+    return FakeValue(self.memory, self.GetValueAsUnsigned(), self.type_.pointee, "*" + self.name)
+
+  def GetChildAtIndex(self, i):
+    if self.type_.IsPointerType():
+      (name, type_, offset) = self.type_.pointee.fields[i]
+      return FakeValue(self.memory, self.GetValueAsUnsigned() + offset, type_, name)
+    (name, type_, offset) = self.type_.fields[i]
+    return FakeValue(self.memory, self.addr + offset, type_, name)
+
+class FakeProcess(object):
+  def __init__(self, memory):
+    self.memory = memory
+
+  def ReadMemory(self, addr, size, error):
+    return self.memory.read(addr, size)
+
+class FakeTarget(object):
+  def __init__(self, memory):
+    self.memory = memory
+
+  def CreateValueFromAddress(self, name, address, type_):
+    return FakeValue(self.memory, address.addr, type_, name)
+
+
+NODE_A = 0x1000
+NODE_B = 0x1100
+NAME_C = 0x1200
+STR_D = 0x1300
+
+@unittest.skipIf(sys.version_info[0] > 2, "Trace.py runs under python 2")
+class HeapSnapshotTest(unittest.TestCase):
+  def setUp(self):
+    self.memory = FakeMemory()
+    self.trace = Trace("hello.c", "hello.exe", "hello.trace")
+    self.trace.process = FakeProcess(self.memory)
+    self.trace.target = FakeTarget(self.memory)
+    self.decoded = []
+    object_view = self.trace.object_view
+    def counting_object_view(sb_value):
+      self.decoded.append(sb_value.GetValueAsUnsigned())
+      return object_view(sb_value)
+    self.trace.object_view = counting_object_view
+
+    # A -> B, B -> 0
+    self.alloc(NODE_A, 16)
+    self.alloc(NODE_B, 16)
+    self.memory.write_int(NODE_A, 1)
+    self.memory.write_pointer(NODE_A + 8, NODE_B)
+    self.memory.write_int(NODE_B, 2)
+    self.memory.write_pointer(NODE_B + 8, 0)
+
+  def alloc(self, addr, num_bytes):
+    self.trace.process_stdout("Alloc = %s , %d\r\n"%(hex(addr), num_bytes))
+
+  def free(self, addr):
+    self.trace.process_stdout("free %s\r\n"%hex(addr))
+
+  def step(self, addr, pointer_type):
+    # Snapshot the heap reachable from a pointer at addr, as dump_status does
+    self.decoded = []
+    self.trace.reset_heap_snapshot()
+    self.trace.put_in_heap(FakeValue(self.memory, None, pointer_type, "root", addr))
+    return self.trace.heap
+
+  def test_cache_hit_when_bytes_unchanged(self):
+    first = self.step(NODE_A, NODE_PTR)
+    self.assertEqual(sorted(self.decoded), [NODE_A, NODE_B])
+    second = self.step(NODE_A, NODE_PTR)
+    self.assertEqual(self.decoded, [])
+    self.assertEqual(second, first)
+    self.assertEqual(second[NODE_A], ["DICT", ["field", 1], ["next", ["REF", NODE_B, "REF_HEAP"]]])
+
+  def test_redecode_after_byte_change(self):
+    self.step(NODE_A, NODE_PTR)
+    self.memory.write_int(NODE_B, 20)
+    heap = self.step(NODE_A, NODE_PTR)
+    # A is unchanged, B is reached through the cached refs of A
+    self.assertEqual(self.decoded, [NODE_B])
+    self.assertEqual(heap[NODE_B], ["DICT", ["field", 20], ["next", "Invalid"]])
+
+  def test_invalidate_on_free_and_alloc(self):
+    self.step(NODE_A, NODE_PTR)
+    # The bytes of A do not change, but its pointer to B is now dangling
+    self.free(NODE_B)
+    heap = self.step(NODE_A, NODE_PTR)
+    self.assertEqual(self.decoded, [NODE_A])
+    self.assertEqual(heap[NODE_A], ["DICT", ["field", 1], ["next", "Invalid"]])
+    self.assertFalse(NODE_B in heap)
+
+    self.alloc(NODE_B, 16)
+    heap = self.step(NODE_A, NODE_PTR)
+    self.assertEqual(sorted(self.decoded), [NODE_A, NODE_B])
+    self.assertEqual(heap[NODE_A], ["DICT", ["field", 1], ["next", ["REF", NODE_B, "REF_HEAP"]]])
+
+  def test_cycle_walked_once(self):
+    self.memory.write_pointer(NODE_B + 8, NODE_A)
+    heap = self.step(NODE_A, NODE_PTR)
+    self.assertEqual(sorted(self.decoded), [NODE_A, NODE_B])
+    self.assertEqual(heap[NODE_B], ["DICT", ["field", 2], ["next", ["REF", NODE_A, "REF_HEAP"]]])
+    self.step(NODE_A, NODE_PTR)
+    self.assertEqual(self.decoded, [])
+
+  def test_string_chunk_not_cached(self):
+    self.alloc(NAME_C, 8)
+    self.memory.write_pointer(NAME_C, STR_D)
+    self.memory.write(STR_D, b"abc\x00")
+    heap = self.step(NAME_C, NAME_PTR)
+    self.assertEqual(heap[NAME_C], ["DICT", ["str", "abc"]])
+    self.assertFalse(NAME_C in self.trace._heap_cache)
+
+    # The string changes outside of the chunk bytes
+    self.memory.write(STR_D, b"xy\x00")
+    heap = self.step(NAME_C, NAME_PTR)
+    self.assertEqual(self.decoded, [NAME_C])
+    self.assertEqual(heap[NAME_C], ["DICT", ["str", "xy"]])
+
+class InterruptCountingProcess(object):
+  def __init__(self):
+    self.num_interrupt = 0
+
+  def SendAsyncInterrupt(self):
+    self.num_interrupt += 1
+
+@unittest.skipIf(sys.version_info[0] > 2, "Trace.py runs under python 2")
+class BudgetTest(unittest.TestCase):
+  def setUp(self):
+    self.trace = Trace("hello.c", "hello.exe", "hello.trace", max_wall_time=10,
+                       max_target_memory=100, start_time=time.time())
+
+  def test_watchdog_interrupts_until_done(self):
+    # An interrupt may be ignored while the target is stopped, so the
+    # watchdog keeps sending them until trace_steps returns
+    self.trace.process = InterruptCountingProcess()
+    self.trace.budget.max_wall_time = 0
+    self.trace.INTERRUPT_INTERVAL = 0.01
+    watchdog = threading.Thread(target=self.trace.watchdog)
+    watchdog.start()
+    deadline = time.time() + 5
+    while self.trace.process.num_interrupt < 3 and time.time() < deadline:
+      time.sleep(0.01)
+    self.trace._tracing_done.set()
+    watchdog.join()
+    self.assertTrue(self.trace._deadline_hit)
+    self.assertTrue(self.trace.process.num_interrupt >= 3)
+
+  def test_watchdog_idle_before_deadline(self):
+    self.trace.process = InterruptCountingProcess()
+    watchdog = threading.Thread(target=self.trace.watchdog)
+    watchdog.start()
+    self.trace._tracing_done.set()
+    watchdog.join()
+    self.assertFalse(self.trace._deadline_hit)
+    self.assertEqual(self.trace.process.num_interrupt, 0)
+
+  def test_target_memory(self):
+    self.trace.process_stdout("Alloc = 0x1000 , 60\r\n")
+    self.assertEqual(self.trace.exceeded_budget(1), None)
+    self.trace.process_stdout("Alloc = 0x2000 , 40\r\n")
+    self.assertEqual(self.trace.exceeded_budget(1), "heap memory exceeds 100 bytes")
+    self.trace.process_stdout("free 0x1000\r\n")
+    self.assertEqual(self.trace._target_memory, 40)
+    self.assertEqual(self.trace.exceeded_budget(1), None)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -1,16 +1,16 @@
 #!/usr/bin/env python
 
 from __future__ import print_function
+import time
+# The trace wall time budget counts from here
+START_TIME = time.time()
 import subprocess
 import os
 import sys
 import logging
 import tempfile
 import codecs
-import clang
-from Trace import Trace
-from CTutorUtils import CTutorCommand
-from CTutorParser import CParser
+from CTutorUtils import CTutorCommand, CTutorStageTimer
 
 LOGGING_FORMAT= "%(name)s:%(levelname)s %(module)s:%(lineno)d:  %(message)s"
 logging.basicConfig(filename="CTutor.log", level=logging.DEBUG, format= LOGGING_FORMAT)
@@ -26,13 +26,30 @@ class CTutorSingle(object):
   # second count for clang to finish the source code compile process
   MAX_COMPILE_TIME=20 
    
-  def __init__(self, user_id, libpath=""):
+  def __init__(self, user_id, libpath="", trace_budgets=None, backend="lldb"):
     self.src_f = tempfile.NamedTemporaryFile(prefix=user_id, suffix=".c",  delete=False)
     self.bin_fn = self.src_f.name + ".exe"
     self.raw_trace_fn = self.src_f.name + ".rawt"
     self.trace_fn = self.src_f.name + ".trace"
     self.js_fn = self.src_f.name + ".js"
     self._libpath=libpath
+    self._trace_budgets=trace_budgets or {}
+    self.load_backend(backend)
+
+  def load_backend(self, backend):
+    # "lldb" uses clang/LLDB, "standin" uses CTutorStandin so the pipeline
+    # can run without llvm, e.g. for load_test.py
+    if backend == "standin":
+      import CTutorStandin
+      self._compiler = CTutorStandin.standin_compiler()
+      self._parser_cls = CTutorStandin.StandinParser
+      self._trace_cls = CTutorStandin.StandinTrace
+    else:
+      from Trace import Trace
+      from CTutorParser import CParser
+      self._compiler = self.COMPILER
+      self._parser_cls = CParser
+      self._trace_cls = Trace
 
   def stdin_to_ctmpfile(self):
     for line in sys.stdin:
@@ -48,7 +65,7 @@ class CTutorSingle(object):
 
   def build_src(self):
     #build_cmd_lst = [self.COMPILER, "-O0", "-static", "-g", self.src_f.name, self._libpath+self.STATIC_LIBSAMPLE, "-o "+self.bin_fn]
-    build_cmd_lst = [self.COMPILER,"-O0", "-g", self.src_f.name, self._libpath+self.LIBSAMPLE, "-o "+self.bin_fn]
+    build_cmd_lst = [self._compiler,"-O0", "-g", self.src_f.name, self._libpath+self.LIBSAMPLE, "-o "+self.bin_fn]
     #subprocess.check_output(" ".join(build_cmd_lst), shell=True)
     clang_command = CTutorCommand(build_cmd_lst)
     clang_ret = clang_command.run(timeout = self.MAX_COMPILE_TIME)
@@ -61,7 +78,7 @@ class CTutorSingle(object):
   def check_blocked_function(self):
     #Check whether the code have dangerous system calls
     logging.debug("Check whether the c code have dangerous system call")
-    cparser = CParser(self.src_f.name)
+    cparser = self._parser_cls(self.src_f.name)
     has_dangerous_call = cparser.check_all_func_call()
     if has_dangerous_call:
       logging.error("The submited code has dangerous systems calls, Stop CTutor, filename:%s"%self.src_f.name)
@@ -69,7 +86,7 @@ class CTutorSingle(object):
       
 
   def generate_trace(self):
-    trace_obj = Trace(self.src_f.name, self.bin_fn, self.trace_fn)
+    trace_obj = self._trace_cls(self.src_f.name, self.bin_fn, self.trace_fn, **self._trace_budgets)
     trace_obj.run()
 
   def generate_tmpjs(self):
@@ -103,21 +120,46 @@ class CTutorSingle(object):
     shutil.copyfile(self.js_fn, new_js_fn);
     
 
+def get_trace_budgets():
+  # Per-run trace budgets from the env, unset ones fall back to the Trace defaults
+  budgets = {}
+  for (name, env_name, conv) in [("max_num_step", "CTUTOR_MAX_NUM_STEP", int),
+                                 ("max_wall_time", "CTUTOR_MAX_WALL_TIME", float),
+                                 ("max_trace_bytes", "CTUTOR_MAX_TRACE_BYTES", int),
+                                 ("max_target_memory", "CTUTOR_MAX_TARGET_MEMORY", int)]:
+    env_value = os.getenv(env_name)
+    if env_value:
+      budgets[name] = conv(env_value)
+  return budgets
+
 def main(argv):
   user_id = os.getenv("USERID", "Ctutor_USER_UNKNOWN_")
-  logging.debug("c_tutor.py: call CTutor with parms %s, USERID=%s"%(" ".join(argv), user_id))
-  tutor_obj = CTutorSingle(user_id, "/home/lingkun/CTutor/CTutor/")
-  if len(argv) == 1:
-    tutor_obj.stdin_to_ctmpfile()
-  else:
-    tutor_obj.file_to_ctmpfile(argv[1])
-  tutor_obj.build_src()
-  tutor_obj.check_blocked_function()
-  tutor_obj.generate_trace()
-  tutor_obj.generate_tmpjs()
-  tutor_obj.tmpjs_to_stdout()
-  if len(argv) == 3:
-    tutor_obj.tmpjs_to_js(argv[2])
+  trace_budgets = get_trace_budgets()
+  trace_budgets["start_time"] = START_TIME
+  backend = os.getenv("CTUTOR_BACKEND", "lldb")
+  logging.debug("c_tutor.py: call CTutor with parms %s, USERID=%s, budgets=%s, backend=%s"%(" ".join(argv), user_id, str(trace_budgets), backend))
+  timer = CTutorStageTimer()
+  try:
+    with timer.stage("setup"):
+      tutor_obj = CTutorSingle(user_id, "/home/lingkun/CTutor/CTutor/", trace_budgets, backend)
+      if len(argv) == 1:
+        tutor_obj.stdin_to_ctmpfile()
+      else:
+        tutor_obj.file_to_ctmpfile(argv[1])
+    with timer.stage("compile"):
+      tutor_obj.build_src()
+    with timer.stage("safety_check"):
+      tutor_obj.check_blocked_function()
+    with timer.stage("trace"):
+      tutor_obj.generate_trace()
+    with timer.stage("render"):
+      tutor_obj.generate_tmpjs()
+      tutor_obj.tmpjs_to_stdout()
+      if len(argv) == 3:
+        tutor_obj.tmpjs_to_js(argv[2])
+  finally:
+    # Per-stage timings for load_test.py, only written when CTUTOR_STAGE_LOG is set
+    timer.dump(os.getenv("CTUTOR_STAGE_LOG"), argv[1] if len(argv) > 1 else "<stdin>")
 
 if __name__ == "__main__":
     main(sys.argv)
@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import argparse
+import glob
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+  from urllib.parse import urlencode
+  from urllib.request import urlopen
+except ImportError:
+  from urllib import urlencode
+  from urllib2 import urlopen
+
+# Load test for the whole CTutor path: submission -> c_tutor.py (compile,
+# safety check, trace, render) -> response.
+#
+# Two modes:
+#   direct: spawn c_tutor.py for each submission, as portal_ctutor.js does.
+#   portal: POST each submission to a running portal_ctutor.js. Start the portal
+#           with CTUTOR_STAGE_LOG set, and pass the same path with --stage-log.
+#
+# c_tutor.py appends its per-stage timings to CTUTOR_STAGE_LOG. The load test
+# matches them to submissions by a tag in the source file name, and reports
+# throughput and p50/p95/p99 latency for each stage. "overhead" is the end to
+# end latency not spent in any stage (HTTP, process spawn, python startup).
+#
+# With "--backend standin" (direct mode), c_tutor.py uses CTutorStandin instead
+# of clang and LLDB, so the load test runs on a plain Linux box.
+#
+# Example:
+#   $ ./load_test.py --backend standin -c 8 -n 200 -o report.json
+#   $ ./load_test.py --backend standin -c 8 -n 200 --baseline report.json
+
+CTUTOR_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CORPUS = os.path.join(CTUTOR_DIR, "loadtest_corpus")
+PERCENTILES = [50, 95, 99]
+
+
+def percentile(sorted_values, pct):
+  # Nearest-rank percentile
+  if not sorted_values:
+    return None
+  rank = int(math.ceil(pct / 100.0 * len(sorted_values))) - 1
+  return sorted_values[max(0, min(rank, len(sorted_values) - 1))]
+
+def summarize(values):
+  values = sorted(values)
+  summary = {
+    'count' : len(values),
+    'mean' : sum(values) / len(values) if values else None,
+    'max' : values[-1] if values else None,
+  }
+  for pct in PERCENTILES:
+    summary['p%d'%pct] = percentile(values, pct)
+  return summary
+
+def load_corpus(corpus_dir):
+  corpus = []
+  for fn in sorted(glob.glob(os.path.join(corpus_dir, "*.c"))):
+    corpus.append((os.path.basename(fn), open(fn).read()))
+  if not corpus:
+    sys.exit("load_test: no *.c file in corpus %s"%corpus_dir)
+  return corpus
+
+def read_stage_log(fn):
+  records = []
+  if not os.path.exists(fn):
+    return records
+  for line in open(fn):
+    line = line.strip()
+    if line:
+      records.append(json.loads(line))
+  return records
+
+def match_stage_records(records, run_tag):
+  # Match stage records to submission tags "<run_tag>_<index>" by the source
+  # file name, which is "<tag>.c" in direct mode, and "<md5>_<tag>.c" when
+  # written by portal_ctutor.js. Records of other runs are dropped.
+  stage_records = {}
+  for record in records:
+    fn = os.path.splitext(os.path.basename(record['src']))[0]
+    if fn.startswith(run_tag + "_"):
+      stage_records[fn] = record
+    elif "_" + run_tag + "_" in fn:
+      stage_records[fn[fn.index("_" + run_tag + "_") + 1:]] = record
+  return stage_records
+
+def check_python(python):
+  # c_tutor.py only runs under python 2, with any other python every request
+  # fails in setup
+  try:
+    ret = subprocess.call([python, "-c", "import sys; sys.exit(sys.version_info[0] != 2)"])
+  except OSError:
+    ret = -1
+  if ret != 0:
+    sys.exit("load_test: c_tutor.py needs python 2, but --python %s is not python 2"%python)
+
+
+class LoadTest(object):
+  def __init__(self, args):
+    self.args = args
+    self.corpus = load_corpus(args.corpus)
+    self.work_dir = tempfile.mkdtemp(prefix="ctutor_loadtest_")
+    # Unique per load generator, several may share one --stage-log
+    self.run_tag = "lt%d_%d"%(int(time.time()), os.getpid())
+    self.stage_log = args.stage_log or os.path.join(self.work_dir, "stages.log")
+    self.results = []
+    self._lock = threading.Lock()
+    self._next = 0
+
+  def submission_tag(self, index):
+    return "%s_%d"%(self.run_tag, index)
+
+  def run_direct(self, index, code):
+    tag = self.submission_tag(index)
+    src_fn = os.path.join(self.work_dir, tag + ".c")
+    js_fn = os.path.join(self.work_dir, tag + ".js")
+    src_f = open(src_fn, "w")
+    src_f.write(code)
+    src_f.close()
+    env = dict(os.environ)
+    env["CTUTOR_BACKEND"] = self.args.backend
+    env["CTUTOR_STAGE_LOG"] = self.stage_log
+    env["USERID"] = tag
+    devnull = open(os.devnull, "w")
+    ret = subprocess.call([self.args.python, os.path.join(CTUTOR_DIR, "c_tutor.py"), src_fn, js_fn],
+                          cwd=self.work_dir, env=env, stdout=devnull, stderr=devnull)
+    devnull.close()
+    return ret == 0 and os.path.exists(js_fn)
+
+  def run_portal(self, index, code):
+    tag = self.submission_tag(index)
+    data = urlencode({'code' : code, 'user' : tag}).encode("utf-8")
+    body = urlopen(self.args.url, data, self.args.timeout).read()
+    return body.strip() != b"false"
+
+  def worker(self):
+    while True:
+      with self._lock:
+        index = self._next
+        self._next += 1
+      if index >= self.args.num_requests:
+        return
+      (name, code) = self.corpus[index % len(self.corpus)]
+      start = time.time()
+      try:
+        if self.args.mode == "portal":
+          ok = self.run_portal(index, code)
+        else:
+          ok = self.run_direct(index, code)
+        error = None if ok else "failed"
+      except Exception as e:
+        ok = False
+        error = str(e)
+      latency = time.time() - start
+      with self._lock:
+        self.results.append({'tag' : self.submission_tag(index), 'name' : name,
+                             'ok' : ok, 'error' : error, 'latency' : latency})
+
+  def run(self):
+    start = time.time()
+    threads = [threading.Thread(target=self.worker) for i in range(self.args.concurrency)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    elapsed = time.time() - start
+    report = self.report(elapsed)
+    if not self.args.keep:
+      shutil.rmtree(self.work_dir, ignore_errors=True)
+    return report
+
+  def report(self, elapsed):
+    stage_records = match_stage_records(read_stage_log(self.stage_log), self.run_tag)
+
+    stage_names = []
+    stage_values = {}
+    for result in self.results:
+      values = {'request' : result['latency']}
+      record = stage_records.get(result['tag'])
+      if record != None:
+        for (name, seconds) in record['stages']:
+          if not name in stage_names:
+            stage_names.append(name)
+          values[name] = seconds
+        values['overhead'] = result['latency'] - sum(seconds for (name, seconds) in record['stages'])
+        result['failed_stage'] = record['failed_stage']
+      for (name, seconds) in values.items():
+        stage_values.setdefault(name, []).append(seconds)
+
+    num_ok = len([result for result in self.results if result['ok']])
+    stages = {}
+    for name in ['request'] + stage_names + ['overhead']:
+      if name in stage_values:
+        stages[name] = summarize(stage_values[name])
+    failures = {}
+    for result in self.results:
+      if not result['ok']:
+        key = "%s: %s"%(result['name'], result.get('failed_stage') or result['error'])
+        failures[key] = failures.get(key, 0) + 1
+
+    return {
+      'config' : {
+        'mode' : self.args.mode,
+        'backend' : self.args.backend if self.args.mode == "direct" else None,
+        'url' : self.args.url if self.args.mode == "portal" else None,
+        'concurrency' : self.args.concurrency,
+        'num_requests' : self.args.num_requests,
+        'corpus' : [name for (name, code) in self.corpus],
+      },
+      'started' : time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(time.time() - elapsed)),
+      'elapsed' : elapsed,
+      'num_ok' : num_ok,
+      'num_failed' : len(self.results) - num_ok,
+      'throughput' : len(self.results) / elapsed if elapsed > 0 else None,
+      'stages' : stages,
+      'stage_order' : ['request'] + stage_names + ['overhead'],
+      'failures' : failures,
+    }
+
+
+def fmt_ms(seconds):
+  if seconds == None:
+    return "-"
+  return "%.1f"%(seconds * 1000)
+
+def print_report(report, baseline=None):
+  print("mode=%s concurrency=%d requests=%d elapsed=%.2fs"%(
+    report['config']['mode'], report['config']['concurrency'],
+    report['config']['num_requests'], report['elapsed']))
+  line = "throughput: %.2f req/s, ok: %d, failed: %d"%(
+    report['throughput'], report['num_ok'], report['num_failed'])
+  if baseline != None:
+    line += " (baseline %.2f req/s)"%baseline['throughput']
+  print(line)
+  for (failure, count) in sorted(report['failures'].items()):
+    print("  failed %dx %s"%(count, failure))
+
+  columns = ["mean", "p50", "p95", "p99", "max"]
+  print("\n%-14s"%"stage (ms)" + "".join("%18s"%column for column in columns))
+  for name in report['stage_order']:
+    if not name in report['stages']:
+      continue
+    summary = report['stages'][name]
+    base = baseline['stages'].get(name) if baseline != None else None
+    cells = []
+    for column in columns:
+      cell = fmt_ms(summary[column])
+      if base != None and base[column] and summary[column] != None:
+        cell += " (%+.0f%%)"%((summary[column] / base[column] - 1) * 100)
+      cells.append(cell)
+    print("%-14s"%name + "".join("%18s"%cell for cell in cells))
+
+def main(argv):
+  parser = argparse.ArgumentParser(description="Load test for c_tutor.py and portal_ctutor.js")
+  parser.add_argument("--mode", choices=["direct", "portal"], default="direct")
+  parser.add_argument("--backend", choices=["lldb", "standin"], default="lldb",
+                      help="c_tutor.py backend in direct mode")
+  parser.add_argument("--url", default="http://localhost:8080/", help="portal url in portal mode")
+  parser.add_argument("--stage-log", help="CTUTOR_STAGE_LOG of the portal in portal mode")
+  parser.add_argument("--python", default="python2", help="python 2 used to run c_tutor.py in direct mode")
+  parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="directory of *.c submissions")
+  parser.add_argument("-c", "--concurrency", type=int, default=4)
+  parser.add_argument("-n", "--num-requests", type=int, default=100)
+  parser.add_argument("--timeout", type=float, default=30, help="seconds per portal request")
+  parser.add_argument("-o", "--output", help="write the JSON report here")
+  parser.add_argument("--baseline", help="JSON report of a previous release to compare with")
+  parser.add_argument("--keep", action="store_true", help="keep the temporary work dir")
+  args = parser.parse_args(argv[1:])
+
+  if args.mode == "direct":
+    check_python(args.python)
+  if args.mode == "portal" and not args.stage_log:
+    print("load_test: no --stage-log, only end to end latency is reported", file=sys.stderr)
+
+  report = LoadTest(args).run()
+  baseline = json.load(open(args.baseline)) if args.baseline else None
+  print_report(report, baseline)
+  if args.output:
+    out_f = open(args.output, "w")
+    json.dump(report, out_f, sort_keys=True, indent=2, separators=(',',':'))
+    out_f.close()
+
+if __name__ == "__main__":
+  main(sys.argv)
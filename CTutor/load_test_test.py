@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+
+import unittest
+from load_test import percentile, summarize, match_stage_records
+
+class PercentileTest(unittest.TestCase):
+  def test_nearest_rank(self):
+    values = list(range(1, 101))
+    self.assertEqual(percentile(values, 50), 50)
+    self.assertEqual(percentile(values, 95), 95)
+    self.assertEqual(percentile(values, 99), 99)
+    self.assertEqual(percentile(values, 100), 100)
+
+  def test_small_lists(self):
+    self.assertEqual(percentile([], 50), None)
+    self.assertEqual(percentile([7], 99), 7)
+    self.assertEqual(percentile([1, 2, 3], 50), 2)
+    self.assertEqual(percentile([1, 2, 3, 4], 50), 2)
+
+  def test_summarize(self):
+    summary = summarize([3, 1, 2, 4])
+    self.assertEqual(summary['count'], 4)
+    self.assertEqual(summary['max'], 4)
+    self.assertEqual(summary['p50'], 2)
+    self.assertEqual(summary['p99'], 4)
+
+class MatchStageRecordsTest(unittest.TestCase):
+  def test_direct_and_portal(self):
+    records = [{'src' : '/tmp/w/lt100_42_0.c'},
+               {'src' : '/tmp/portal/ori/0e82f6df_lt100_42_1.c'}]
+    matched = match_stage_records(records, "lt100_42")
+    self.assertEqual(sorted(matched), ["lt100_42_0", "lt100_42_1"])
+    self.assertEqual(matched["lt100_42_1"], records[1])
+
+  def test_other_runs_dropped(self):
+    # Same second, other pid, including a pid which has this pid as prefix
+    records = [{'src' : '/tmp/w/lt100_43_0.c'},
+               {'src' : '/tmp/w/lt100_421_0.c'},
+               {'src' : '/tmp/portal/ori/0e82f6df_lt100_421_0.c'},
+               {'src' : '<stdin>'}]
+    self.assertEqual(match_stage_records(records, "lt100_42"), {})
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,12 @@
+#include <stdio.h>
+
+// Never ends, with the lldb backend the trace is cut off by the trace budgets.
+// The stand-in backend does not run the program, so it traces every line once.
+int main(int argc, char *argv[])
+{
+  int i = 0;
+  while (1) {
+    i = i + 1;
+  }
+  return 0;
+}
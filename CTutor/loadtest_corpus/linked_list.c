@@ -0,0 +1,25 @@
+#include <stdio.h>
+#include <stdlib.h>
+
+struct node {
+  int field;
+  struct node* next;
+};
+
+int main(int argc, char *argv[])
+{
+  struct node* head = 0;
+  int i;
+  for (i = 0; i < 5; i++) {
+    struct node* nd = (struct node*)malloc(sizeof(struct node));
+    nd->field = i;
+    nd->next = head;
+    head = nd;
+  }
+  while (head) {
+    struct node* next = head->next;
+    free(head);
+    head = next;
+  }
+  return 0;
+}
@@ -0,0 +1,12 @@
+#include <stdio.h>
+
+int main(int argc, char *argv[])
+{
+  int i;
+  int sum = 0;
+  for (i = 0; i < 10; i++) {
+    sum = sum + i;
+  }
+  printf("sum=%d\n", sum);
+  return 0;
+}
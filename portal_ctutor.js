@@ -12,7 +12,9 @@
 var CONFIG = {
     PORT: , // please use your port
     TYPE: "text/javascript",
-    DIR: "" // please specify your dir path
+    DIR: "", // please specify your dir path
+    TIMEOUT: 5000, // ms before a worker is killed
+    TRACE_MARGIN: 1000 // ms of TIMEOUT kept for python startup and writing a partial trace
 };
 
 /***** Package importations *****/
@@ -23,8 +25,7 @@ var http = require("http"),
     spawn = require("child_process").spawn;
 
 /***** Initializations *****/
-var server = new http.Server(),
-    worker = null;
+var server = new http.Server();
 
 /***** Event Listeners *****/
 server.on("request", function (req, res) {
@@ -81,18 +82,27 @@ function work(id, user, callback) {
     var _ori_path = CONFIG.DIR + "ori/" + id + "_" + user + ".c",
         _path = CONFIG.DIR + "src/" + id + "_" + user + ".js",
         _options = {
-            env: process.env
+            env: {},
+            // The result is read from _path. An unread stdout pipe blocks the
+            // worker once it is full, so that the worker never gets to exit.
+            stdio: ["ignore", "ignore", "inherit"]
         };
-    worker = spawn("python", ["CTutor/c_tutor.py", _ori_path, _path]);
+    for (var key in process.env) {
+        _options.env[key] = process.env[key];
+    }
+    // Let the trace stop itself with a partial trace before the worker is killed
+    _options.env.CTUTOR_MAX_WALL_TIME = String((CONFIG.TIMEOUT - CONFIG.TRACE_MARGIN) / 1000);
+    // Each request has its own worker, so that the timeout only kills its own
+    var worker = spawn("python", ["CTutor/c_tutor.py", _ori_path, _path], _options),
+        timer = setTimeout(function () {
+            worker.kill("SIGKILL");
+        }, CONFIG.TIMEOUT);
     log("tutor done");
     worker.on("exit", function (code, signal) {
 	log("working finish");
-        worker.kill(signal);
+        clearTimeout(timer);
         callback(_path, code);
     });
-    setTimeout(function () {
-        worker.kill("SIGKILL");
-    }, 5000);
     return;
 }
 